@@ -4,18 +4,19 @@
 
 import os
 import sys
+import queue
 import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, messagebox
 from pathlib import Path
 
-from token_manager import TokenManager
+from token_manager import TokenManager, FACTORY_AUTH_FILE, TOKENS_FILE
 from log_monitor import LogMonitor, CLIPromptHandler
 
 # 导入必要的常量
-from token_manager import WARN_THRESHOLD
+from token_manager import WARN_THRESHOLD, TOKEN_EXPIRY_MARGIN
 
 # exe 运行时用 exe 所在目录，否则用脚本目录
 if getattr(sys, 'frozen', False):
@@ -25,6 +26,39 @@ else:
 
 LOCK_FILE = BASE_DIR / ".token_manager.lock"
 CHECK_INTERVAL = 90
+# token 临近过期时，把检查安排在进入刷新窗口（剩余有效期 < TOKEN_EXPIRY_MARGIN）后 RENEW_TICK_SLACK 秒，
+# 这次检查会直接刷新 token；两次检查至少间隔 MIN_CHECK_INTERVAL 秒
+RENEW_TICK_SLACK = 5
+MIN_CHECK_INTERVAL = 30
+LOG_MAX_LINES = 500
+LOG_FLUSH_INTERVAL_MS = 100
+QUERY_MAX_WORKERS = 8
+CLOSE_SYNC_TIMEOUT = 1.0
+# 检查 tokens.json/auth.json 是否被外部程序改动的间隔（毫秒）
+EXTERNAL_CHANGE_POLL_MS = 2000
+
+_USAGE_FAIL = "查询失败"
+_USAGE_NONE = "未查询"
+# 额度文字模板只构造一次，列表与日志共用
+_USAGE_FMT = "已用：{:.1%}，剩余：{:.1%}".format
+_ACTIVE_USAGE_FMT = "ID: {} | 已用：{:.1%} | 剩余：{:.1%}".format
+
+
+def _visible_tokens(tokens: list, active: dict | None) -> list:
+    """备用池中除当前激活账号外的条目，即列表要显示、批量检查要查询的那些"""
+    active_id = active.get("id") if active else None
+    return [t for t in tokens if t.get("id") != active_id]
+
+
+def _format_usage(ratio) -> str:
+    """把额度比例格式化为列表中“额度”列的文字"""
+    if ratio is None:
+        return _USAGE_NONE
+    if ratio >= 0:
+        return _USAGE_FMT(ratio, 1 - ratio)
+    if ratio == -1:
+        return _USAGE_FAIL
+    return _USAGE_NONE
 
 
 class TokenManagerGUI:
@@ -38,10 +72,8 @@ class TokenManagerGUI:
             if sys.platform == 'win32':
                 import msvcrt
                 try:
-                    self._lock_file = open(LOCK_FILE, 'w')
+                    self._lock_file = self._open_lock_file()
                     msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_NBLCK, 1)
-                    self._lock_file.write(str(os.getpid()))
-                    self._lock_file.flush()
                 except (IOError, OSError):
                     if self._lock_file:
                         self._lock_file.close()
@@ -51,10 +83,8 @@ class TokenManagerGUI:
                 # Unix/Linux使用fcntl
                 import fcntl
                 try:
-                    self._lock_file = open(LOCK_FILE, 'w')
+                    self._lock_file = self._open_lock_file()
                     fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    self._lock_file.write(str(os.getpid()))
-                    self._lock_file.flush()
                 except (IOError, OSError):
                     if self._lock_file:
                         self._lock_file.close()
@@ -76,6 +106,19 @@ class TokenManagerGUI:
         self._check_all_inflight = False
         self._check_selected_inflight = False
         self._switch_inflight = False
+        # 上面几个标志的"检查并置位"统一在锁内完成
+        self._inflight_lock = threading.Lock()
+        # 工作线程的日志先入队，由 UI 线程定时批量写入
+        self._log_queue = queue.Queue()
+        self._log_flush_scheduled = False
+        # 退出流程中关闭日志，避免为已不可见的控件格式化/排队日志
+        self._logging_enabled = True
+        # 同一秒内的日志复用时间戳字符串：(秒, "HH:MM:SS")，整体赋值保证跨线程读取一致
+        self._last_ts = (0, "")
+        # 通知窗口按类型复用：{key: {"window", "labels", "hide_id"}}
+        self._notification_windows = {}
+        # 额度查询线程池在整个进程生命周期内复用，避免每次批量检查都新建/销毁线程
+        self._query_pool = ThreadPoolExecutor(max_workers=QUERY_MAX_WORKERS, thread_name_prefix="usage-query")
         
         # 初始化核心组件
         self.token_manager = TokenManager()
@@ -83,6 +126,15 @@ class TokenManagerGUI:
         self.cli_prompt = CLIPromptHandler(callback=self._cli_callback)
         
         self.monitoring = False
+        self._monitor_after_id = None
+        # 账号 ID -> Treeview 行 ID，用于只更新变化的行
+        self._id_to_treeitem = {}
+        # 当前显示的各行内容与顺序，用于和新数据比对出最小改动
+        self._tree_rows = {}
+        self._tree_order = []
+        self._refresh_pending = False
+        # 上次轮询看到的文件状态：{path: (mtime_ns, size) 或 None}
+        self._seen_file_keys = {}
         
         # 在控制台显示启动信息
         print("=" * 60)
@@ -92,16 +144,25 @@ class TokenManagerGUI:
         print("=" * 60)
 
         self._build_ui()
-        self._init_active_token()
-        self._sync_on_start()
+        # 启动阶段的几步共用同一份 auth.json 内容
+        active = self.token_manager.load_active_token()
+        self._init_active_token(active)
+        self._sync_on_start(active)
         self._refresh_list()
         self._check_active_async(user_initiated=False)
+        self.root.after(EXTERNAL_CHANGE_POLL_MS, self._poll_external_changes)
         
         # 自动启动日志监控
         self.log_monitor.start_monitoring()
         
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
 
+    @staticmethod
+    def _open_lock_file():
+        """打开锁文件但不截断；句柄在进程存活期间一直持有，锁本身即证明归属"""
+        fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        return os.fdopen(fd, 'r+')
+
     def _log_monitor_callback(self, event_type, message):
         """日志监控回调"""
         if event_type == "log":
@@ -130,8 +191,8 @@ class TokenManagerGUI:
             self._log_safe(f"✅ 已自动切换到账号 [{token_id}]")
             # 注意：该回调可能来自日志监控线程，涉及 Tk 的操作必须切回 UI 线程
             self._call_ui(self._prompt_user_continue, token_id)
-            self._call_ui(self._refresh_list)
-            self._call_ui(self._check_active_async, False)
+            self._call_ui_idle(self._refresh_list)
+            self._call_ui_idle(self._check_active_async, False)
         elif status == "error":
             self._log_safe(f"❌ {data}")
             self._call_ui(self._show_error_notification)
@@ -141,7 +202,8 @@ class TokenManagerGUI:
         active_frame = ttk.LabelFrame(self.root, text="当前激活 (auth.json)", padding=5)
         active_frame.pack(fill=tk.X, padx=5, pady=5)
 
-        self.active_label = ttk.Label(active_frame, text="加载中...", font=("", 10))
+        self._active_text = "加载中..."
+        self.active_label = ttk.Label(active_frame, text=self._active_text, font=("", 10))
         self.active_label.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
 
         self.log_monitor_btn = ttk.Button(active_frame, text="启动日志监控", command=self._toggle_log_monitor, width=12)
@@ -196,53 +258,78 @@ class TokenManagerGUI:
         self.log_text.pack(fill=tk.X)
 
     def _log(self, msg):
+        # 统一入队批量写入：同一轮事件里的多条日志只触发一次 Text 更新，且与工作线程日志保持先后顺序
+        self._log_queue.put(f"[{self._log_timestamp()}] {msg}")
+        if self._log_flush_scheduled:
+            return
+        self._log_flush_scheduled = True
+        if threading.get_ident() == self._ui_thread_id:
+            self.root.after_idle(self._flush_logs)
+        else:
+            self.root.after(LOG_FLUSH_INTERVAL_MS, self._flush_logs)
+
+    def _log_timestamp(self) -> str:
+        now_sec = int(time.time())
+        last_sec, last_str = self._last_ts
+        if now_sec != last_sec:
+            last_str = time.strftime("%H:%M:%S", time.localtime(now_sec))
+            self._last_ts = (now_sec, last_str)
+        return last_str
+
+    def _append_log_lines(self, lines: list[str]):
+        """一次性写入多行日志：只切换一次控件状态、只滚动一次"""
         self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, f"[{datetime.now():%H:%M:%S}] {msg}\n")
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        # 日志只保留最近 LOG_MAX_LINES 行，超出时一次性删掉最早的若干行，避免 Text 控件无限增长
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
         self.log_text.see(tk.END)
         self.log_text.config(state=tk.DISABLED)
 
-    def _call_ui(self, fn, *args, **kwargs):
-        self.root.after(0, lambda: fn(*args, **kwargs))
+    def _call_ui(self, fn, *args):
+        # after 本身支持传参，无需每次包一层 lambda
+        self.root.after(0, fn, *args)
+
+    def _call_ui_idle(self, fn, *args):
+        """不急的界面刷新放到空闲时执行，与其他待处理事件合并"""
+        self.root.after_idle(fn, *args)
 
     def _log_safe(self, msg: str):
-        if threading.get_ident() == self._ui_thread_id:
+        # 可在任意线程调用；时间戳在入队时生成，保证批量写入后仍是真实发生时间
+        if self._logging_enabled:
             self._log(msg)
-        else:
-            self._call_ui(self._log, msg)
 
-    def _init_active_token(self):
+    def _flush_logs(self):
+        """批量取出队列中的日志并一次写入"""
+        lines = []
+        while True:
+            try:
+                lines.append(self._log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self._append_log_lines(lines)
+        self._log_flush_scheduled = False
+        # 取空与清标志之间可能又有新日志入队，此时需要重新安排一次
+        if not self._log_queue.empty():
+            self._log_flush_scheduled = True
+            self.root.after(LOG_FLUSH_INTERVAL_MS, self._flush_logs)
+
+    def _init_active_token(self, active: dict | None = None):
         """确保 auth.json 中的账号有 id"""
-        message = self.token_manager.init_active_token()
+        message = self.token_manager.init_active_token(active)
         if message:
             self._log(message)
 
-    def _sync_on_start(self):
+    def _sync_on_start(self, active: dict | None = None):
         """启动时同步"""
-        message = self.token_manager.sync_on_start()
+        message = self.token_manager.sync_on_start(active)
         if message:
             self._log(message)
 
     def _on_closing(self):
         """退出时处理"""
-        self.monitoring = False
-        self.log_monitor.stop_monitoring()
-
-        active = self.token_manager.load_active_token()
-        try:
-            # 获取最后的额度信息
-            at = active.get("access_token", "") if active else ""
-            rt = active.get("refresh_token", "") if active else ""
-            ratio, info, new_tokens = self.token_manager.query_usage(at, rt, timeout=5)
-            
-            if new_tokens and active:
-                active["access_token"] = new_tokens.get("access_token", "")
-                active["refresh_token"] = new_tokens.get("refresh_token", "")
-                self.token_manager.save_active_token(active)
-            
-            self.token_manager.sync_active_to_backup(active, ratio if ratio >= 0 else None)
-        except Exception:
-            pass
-
         # 是否清空 auth.json 交给用户选择（默认保留）
         choice = messagebox.askyesnocancel(
             "退出",
@@ -253,11 +340,55 @@ class TokenManagerGUI:
         )
         if choice is None:
             return
-        if choice is True:
-            if not TokenManager.atomic_write_json(Path(os.path.expanduser("~")) / ".factory" / "auth.json", {}):
-                self._log_safe("清空 auth.json 失败")
 
-        # 释放锁文件
+        self._logging_enabled = False
+        self.monitoring = False
+        self.log_monitor.stop_monitoring()
+        # 先隐藏窗口，最后一次额度同步放到后台线程，避免网络请求卡住界面
+        self.root.withdraw()
+
+        active = self.token_manager.load_active_token()
+        clear_auth = choice is True
+        done = threading.Event()
+
+        def worker():
+            try:
+                # 获取最后的额度信息
+                at = active.get("access_token", "") if active else ""
+                rt = active.get("refresh_token", "") if active else ""
+                ratio, info, new_tokens = self.token_manager.query_usage(at, rt, timeout=5)
+
+                if new_tokens and active:
+                    active["access_token"] = new_tokens.get("access_token", "")
+                    active["refresh_token"] = new_tokens.get("refresh_token", "")
+                    self.token_manager.save_active_token(active)
+
+                self.token_manager.sync_active_to_backup(active, ratio if ratio >= 0 else None)
+            except Exception:
+                pass
+            finally:
+                self.token_manager.flush_pending_tokens()
+                # 必须在同步之后再清空，否则同步会把 token 写回 auth.json
+                if clear_auth and not TokenManager.atomic_write_json(FACTORY_AUTH_FILE, {}):
+                    print("清空 auth.json 失败")
+                # 写盘全部结束后才释放单实例锁，避免新实例启动后被本进程最后的写入覆盖
+                self._release_lock()
+                done.set()
+
+        # 非守护线程：即使界面已先销毁，进程也会等同步写完再退出
+        threading.Thread(target=worker).start()
+        deadline = time.monotonic() + CLOSE_SYNC_TIMEOUT
+
+        def wait_sync():
+            if done.is_set() or time.monotonic() >= deadline:
+                self._finish_closing()
+            else:
+                self.root.after(50, wait_sync)
+
+        wait_sync()
+
+    def _release_lock(self):
+        """释放单实例锁文件"""
         try:
             if self._lock_file:
                 self._lock_file.close()
@@ -265,45 +396,114 @@ class TokenManagerGUI:
         except Exception:
             pass
 
+    def _finish_closing(self):
+        # 锁由同步线程写盘结束后释放，这里只关闭界面
+        # 不等待仍在进行的查询，已提交的任务结束后线程自行退出
+        self._query_pool.shutdown(wait=False)
         self.root.destroy()
 
     def _refresh_list(self):
-        self._update_active_display()
-
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        """请求刷新列表；同一轮事件中的多次请求合并为一次空闲时执行"""
+        if self._refresh_pending:
+            return
+        self._refresh_pending = True
+        self.root.after_idle(self._do_refresh_list)
 
+    def _do_refresh_list(self):
+        self._refresh_pending = False
+        active = self._update_active_display()
         tokens = self.token_manager.load_backup_tokens()
-        active = self.token_manager.load_active_token()
-        active_id = active.get("id") if active else None
+        for warning in self.token_manager.pop_warnings():
+            self._log(f"警告：{warning}")
         
-        display_idx = 0
-        for i, t in enumerate(tokens):
-            if t.get("id") == active_id:
-                continue
-            display_idx += 1
-            status = t.get("status", "active")
-            ratio = t.get("ratio")
-            if ratio is not None and ratio >= 0:
-                remain_ratio = 1 - ratio
-                usage_str = f"已用：{ratio:.1%}，剩余：{remain_ratio:.1%}"
-            elif ratio == -1:
-                usage_str = "查询失败"
-            else:
-                usage_str = "未查询"
-            token_id = t.get("id", "无ID")
-            self.tree.insert("", tk.END, values=(display_idx, token_id, status, usage_str))
+        # 先在 Python 侧算好全部行，再一次性交给 Treeview
+        rows = [
+            (i, t.get("id", "无ID"), t.get("status", "active"), _format_usage(t.get("ratio")))
+            for i, t in enumerate(_visible_tokens(tokens, active), 1)
+        ]
 
+        self._sync_tree_rows(rows)
         self._log(f"列表已刷新，备用账号: {len(tokens)} 个")
 
-    def _update_active_display(self):
-        """更新当前激活账号显示"""
-        active = self.token_manager.load_active_token()
+    def _sync_tree_rows(self, rows: list):
+        """按账号 ID 把列表调和成 rows：只删除消失的行、插入新增的行、改写内容变化的行"""
+        ids = [str(r[1]) for r in rows]
+        if self._tree_order is None or len(set(ids)) != len(ids):
+            # ID 重复（如多个"无ID"）无法一一对应，退回整表重建
+            self._replace_tree_rows(rows)
+            return
+
+        new_ids = set(ids)
+        removed = [tid for tid in self._tree_order if tid not in new_ids]
+        if removed:
+            self.tree.delete(*(self._id_to_treeitem.pop(tid) for tid in removed))
+            for tid in removed:
+                self._tree_rows.pop(tid, None)
+
+        # 留存行的相对顺序没变时，按位置插入新行即可，不必逐行 move
+        kept = [tid for tid in self._tree_order if tid in new_ids]
+        reorder = kept != [tid for tid in ids if tid in self._id_to_treeitem]
+
+        for pos, (tid, r) in enumerate(zip(ids, rows)):
+            item = self._id_to_treeitem.get(tid)
+            if item is None:
+                self._id_to_treeitem[tid] = self.tree.insert("", pos, values=r)
+            else:
+                if self._tree_rows.get(tid) != r:
+                    self.tree.item(item, values=r)
+                if reorder:
+                    self.tree.move(item, "", pos)
+            self._tree_rows[tid] = r
+        self._tree_order = ids
+
+    def _replace_tree_rows(self, rows: list):
+        """整体替换列表内容：一次删除全部行，插入期间隐藏列以避免逐行重排"""
+        self.tree.delete(*self.tree.get_children())
+        self._id_to_treeitem = {}
+        self._tree_rows = {}
+        self.tree.configure(displaycolumns=())
+        try:
+            for r in rows:
+                tid = str(r[1])
+                self._id_to_treeitem[tid] = self.tree.insert("", tk.END, values=r)
+                self._tree_rows[tid] = r
+        finally:
+            self.tree.configure(displaycolumns="#all")
+        # 有重复 ID 时映射不完整，置为 None 让下一次调和继续走整表重建
+        self._tree_order = [str(r[1]) for r in rows] if len(self._tree_rows) == len(rows) else None
+
+    def _update_tree_rows(self, updates: dict) -> bool:
+        """按账号 ID 原地更新若干行的状态/额度列：{token_id: (status, usage_str)}
+
+        有任一 ID 不在当前列表中时不做修改并返回 False，由调用方改为整表刷新。
+        """
+        if any(str(tid) not in self._id_to_treeitem for tid in updates):
+            return False
+        for tid, (status, usage_str) in updates.items():
+            tid = str(tid)
+            old = self._tree_rows[tid]
+            r = (old[0], old[1], status, usage_str)
+            if r != old:
+                self.tree.item(self._id_to_treeitem[tid], values=r)
+                self._tree_rows[tid] = r
+        return True
+
+    def _update_active_display(self, active: dict | None = None) -> dict | None:
+        """更新当前激活账号显示，返回用到的激活账号供调用方复用"""
+        if active is None:
+            active = self.token_manager.load_active_token()
         if active:
             token_id = active.get("id", "无ID")
-            self.active_label.config(text=f"ID: {token_id} (开启监控会自动查询)")
+            self._set_active_text(f"ID: {token_id} (开启监控会自动查询)")
         else:
-            self.active_label.config(text="未找到 auth.json")
+            self._set_active_text("未找到 auth.json")
+        return active
+
+    def _set_active_text(self, text: str):
+        """更新激活账号标签；文字没变时跳过 config，避免无谓的字体测量与重新布局"""
+        if text != self._active_text:
+            self._active_text = text
+            self.active_label.config(text=text)
 
     def _check_active_async(self, user_initiated: bool = True):
         """异步检查当前激活账号额度"""
@@ -315,12 +515,15 @@ class TokenManagerGUI:
             self._log_safe("未找到 auth.json")
             return
 
-        self._active_check_inflight = True
+        if not self._begin_inflight("_active_check_inflight"):
+            return
         token_id = active.get("id", "无ID")
         at = active.get("access_token", "")
         rt = active.get("refresh_token", "")
 
-        self.active_label.config(text=f"ID: {token_id} | 查询中...")
+        # 后台定时检查不切到"查询中"，结果不变时标签就完全不用重绘
+        if user_initiated:
+            self._set_active_text(f"ID: {token_id} | 查询中...")
 
         def worker(active_snapshot: dict):
             try:
@@ -338,24 +541,24 @@ class TokenManagerGUI:
                     try:
                         if ratio >= 0:
                             remain_ratio = 1 - ratio
-                            self._log(f"[{token_id}] 已用：{ratio:.1%}，剩余：{remain_ratio:.1%}")
-                            self.active_label.config(text=f"ID: {token_id} | 已用：{ratio:.1%} | 剩余：{remain_ratio:.1%}")
+                            self._log(f"[{token_id}] {_USAGE_FMT(ratio, remain_ratio)}")
+                            self._set_active_text(_ACTIVE_USAGE_FMT(token_id, ratio, remain_ratio))
                             if user_initiated and ratio >= 0.99:
                                 messagebox.showwarning("额度用尽", "当前账号额度已用完！\n请切换到备用账号。")
                         else:
                             self._log(f"[{token_id}] 查询失败")
-                            self.active_label.config(text=f"ID: {token_id} | 查询失败")
+                            self._set_active_text(f"ID: {token_id} | 查询失败")
                     finally:
-                        self._active_check_inflight = False
+                        self._end_inflight("_active_check_inflight")
 
                 self._call_ui(update_ui)
             except Exception:
                 def update_fail():
                     try:
                         self._log(f"[{token_id}] 查询失败")
-                        self.active_label.config(text=f"ID: {token_id} | 查询失败")
+                        self._set_active_text(f"ID: {token_id} | 查询失败")
                     finally:
-                        self._active_check_inflight = False
+                        self._end_inflight("_active_check_inflight")
 
                 self._call_ui(update_fail)
 
@@ -371,48 +574,43 @@ class TokenManagerGUI:
             self._log("备用池为空")
             return
 
-        self._check_all_inflight = True
+        if not self._begin_inflight("_check_all_inflight"):
+            return
         self._log(f"开始检查 {len(tokens)} 个备用账号...")
 
         active = self.token_manager.load_active_token()
-        active_id = active.get("id") if active else None
 
         def worker(tokens_snapshot: list):
             updated = False
             rows = []
-            display_idx = 0
             try:
-                for t in tokens_snapshot:
-                    if t.get("id") == active_id:
-                        continue
-                    display_idx += 1
+                # 激活账号在循环外一次性过滤掉，循环只处理需要查询的账号
+                to_check = _visible_tokens(tokens_snapshot, active)
+                results = self._query_usage_many(to_check)
+
+                for display_idx, (t, (ratio, info, new_tokens)) in enumerate(zip(to_check, results), 1):
                     token_id = t.get("id", "无ID")
-                    at = t.get("access_token", "")
-                    rt = t.get("refresh_token", "")
                     status = t.get("status", "active")
-
-                    ratio, info, new_tokens = self.token_manager.query_usage(at, rt)
+                    # 条目字段都是标量，浅拷贝即可比较本轮是否真的有变化
+                    before = dict(t)
 
                     if new_tokens:
                         t["access_token"] = new_tokens.get("access_token", "")
                         t["refresh_token"] = new_tokens.get("refresh_token", "")
-                        updated = True
 
+                    usage_str = _format_usage(ratio)
+                    t["available"] = TokenManager.is_available(ratio)
                     if ratio >= 0:
-                        remain_ratio = 1 - ratio
-                        usage_str = f"已用：{ratio:.1%}，剩余：{remain_ratio:.1%}"
                         t["ratio"] = ratio
-                        updated = True
                         if ratio >= WARN_THRESHOLD:
                             status = "额度不足"
                             t["status"] = status
                     else:
-                        usage_str = "查询失败"
                         status = "失效"
                         t["status"] = status
                         t["ratio"] = -1
-                        updated = True
 
+                    updated = updated or t != before
                     rows.append((display_idx, token_id, status, usage_str))
 
                 if updated:
@@ -420,13 +618,10 @@ class TokenManagerGUI:
 
                 def update_ui():
                     try:
-                        for item in self.tree.get_children():
-                            self.tree.delete(item)
-                        for r in rows:
-                            self.tree.insert("", tk.END, values=r)
+                        self._sync_tree_rows(rows)
                         self._log("备用账号检查完成")
                     finally:
-                        self._check_all_inflight = False
+                        self._end_inflight("_check_all_inflight")
 
                 self._call_ui(update_ui)
             except Exception:
@@ -434,20 +629,42 @@ class TokenManagerGUI:
                     try:
                         self._log("备用账号检查失败")
                     finally:
-                        self._check_all_inflight = False
+                        self._end_inflight("_check_all_inflight")
 
                 self._call_ui(update_fail)
 
         threading.Thread(target=worker, args=(tokens,), daemon=True).start()
 
+    def _begin_inflight(self, name: str, *blockers: str) -> bool:
+        """原子地检查并置位进行中标志；name 或任一 blockers 已置位时返回 False"""
+        with self._inflight_lock:
+            if getattr(self, name) or any(getattr(self, b) for b in blockers):
+                return False
+            setattr(self, name, True)
+            return True
+
+    def _end_inflight(self, name: str):
+        with self._inflight_lock:
+            setattr(self, name, False)
+
+    def _query_usage_many(self, tokens: list) -> list:
+        """并发查询多个账号额度，结果顺序与 tokens 一致；回写 token 由调用方在单线程内完成"""
+        if not tokens:
+            return []
+
+        def query(t: dict):
+            # 用户主动检查要最新数据，但结果写入缓存，随后的切换可直接复用
+            return self.token_manager.query_usage(
+                t.get("access_token", ""), t.get("refresh_token", ""), token_id=t.get("id"), max_age=0
+            )
+
+        return list(self._query_pool.map(query, tokens))
+
     def _get_selected_idx(self):
         token_id = self._get_selected_token_id()
         if token_id is None:
             return None
-        for i, t in enumerate(self.token_manager.load_backup_tokens()):
-            if str(t.get("id", "")) == token_id:
-                return i
-        return None
+        return self.token_manager.index_by_id(self.token_manager.load_backup_tokens()).get(token_id)
 
     def _get_selected_token_id(self):
         """获取选中的账号 ID"""
@@ -476,50 +693,54 @@ class TokenManagerGUI:
             messagebox.showinfo("提示", "请先选择要检查的账号")
             return
 
-        self._check_selected_inflight = True
+        if not self._begin_inflight("_check_selected_inflight"):
+            return
         self.check_selected_btn.config(state=tk.DISABLED)
         self._log(f"开始检查选中账号：{len(token_ids)} 个...")
 
         def worker(token_ids_snapshot: list[str]):
             updated = False
+            row_updates = {}
             try:
                 tokens = self.token_manager.load_backup_tokens()
-                tokens_by_id = {str(t.get("id", "")): t for t in tokens}
-
-                for token_id in token_ids_snapshot:
-                    t = tokens_by_id.get(str(token_id))
-                    if not t:
-                        continue
+                tokens_by_id = {t.get("id", ""): t for t in tokens}
 
-                    at = t.get("access_token", "")
-                    rt = t.get("refresh_token", "")
-                    ratio, info, new_tokens = self.token_manager.query_usage(at, rt)
+                to_check = [
+                    (token_id, tokens_by_id[token_id])
+                    for token_id in token_ids_snapshot
+                    if token_id in tokens_by_id
+                ]
+                results = self._query_usage_many([t for _, t in to_check])
 
+                for (token_id, t), (ratio, info, new_tokens) in zip(to_check, results):
+                    before = dict(t)
                     if new_tokens:
                         t["access_token"] = new_tokens.get("access_token", "")
                         t["refresh_token"] = new_tokens.get("refresh_token", "")
-                        updated = True
 
+                    t["available"] = TokenManager.is_available(ratio)
                     if ratio >= 0:
                         t["ratio"] = ratio
                         t["status"] = "额度不足" if ratio >= WARN_THRESHOLD else "active"
-                        updated = True
                         self._log_safe(f"[{token_id}] 已用：{ratio:.1%}")
                     else:
                         t["ratio"] = -1
                         t["status"] = "失效"
-                        updated = True
                         self._log_safe(f"[{token_id}] 查询失败")
+                    updated = updated or t != before
+                    row_updates[token_id] = (t["status"], _format_usage(t["ratio"]))
 
                 if updated:
                     self.token_manager.save_backup_tokens(tokens)
 
                 def update_ui():
                     try:
-                        self._refresh_list()
+                        # 只有选中的几行发生变化，原地更新即可，无需整表重建
+                        if not self._update_tree_rows(row_updates):
+                            self._refresh_list()
                         self._log("选中账号检查完成")
                     finally:
-                        self._check_selected_inflight = False
+                        self._end_inflight("_check_selected_inflight")
                         self.check_selected_btn.config(state=tk.NORMAL)
 
                 self._call_ui(update_ui)
@@ -528,7 +749,7 @@ class TokenManagerGUI:
                     try:
                         self._log("选中账号检查失败")
                     finally:
-                        self._check_selected_inflight = False
+                        self._end_inflight("_check_selected_inflight")
                         self.check_selected_btn.config(state=tk.NORMAL)
 
                 self._call_ui(update_fail)
@@ -546,18 +767,13 @@ class TokenManagerGUI:
             return
 
         tokens = self.token_manager.load_backup_tokens()
-        backup_token = None
-        backup_idx = -1
-        for i, t in enumerate(tokens):
-            if t.get("id") == token_id:
-                backup_token = t
-                backup_idx = i
-                break
-        
-        if backup_token is None:
+        backup_idx = self.token_manager.index_by_id(tokens).get(token_id)
+        if backup_idx is None:
             return
+        backup_token = tokens[backup_idx]
 
-        self._switch_inflight = True
+        if not self._begin_inflight("_switch_inflight", "_check_all_inflight", "_check_selected_inflight"):
+            return
         self.switch_btn.config(state=tk.DISABLED)
         self._log(f"[{token_id}] 查询额度中...")
 
@@ -565,7 +781,8 @@ class TokenManagerGUI:
         rt = backup_token.get("refresh_token", "")
 
         def worker(tokens_snapshot: list, token_snapshot: dict, token_index: int):
-            ratio, info, new_tokens = self.token_manager.query_usage(at, rt)
+            # 刚检查过的账号直接用缓存结果，省去一次请求
+            ratio, info, new_tokens = self.token_manager.query_usage(at, rt, token_id=token_id)
 
             if new_tokens:
                 token_snapshot["access_token"] = new_tokens.get("access_token", "")
@@ -594,41 +811,36 @@ class TokenManagerGUI:
 
                     old_active = self.token_manager.load_active_token()
                     tokens2 = self.token_manager.load_backup_tokens()
-                    backup_token2 = None
-                    backup_idx2 = -1
-                    for i2, t2 in enumerate(tokens2):
-                        if t2.get("id") == token_id:
-                            backup_token2 = t2
-                            backup_idx2 = i2
-                            break
-
-                    if backup_token2 is None:
+                    backup_idx2 = self.token_manager.index_by_id(tokens2).get(token_id)
+                    if backup_idx2 is None:
                         self._log(f"切换失败：未在备用池找到 [{token_id}]")
                         return
+                    backup_token2 = tokens2[backup_idx2]
 
                     if self.token_manager.save_active_token(backup_token2):
                         tokens2.pop(backup_idx2)
 
                         if old_active and old_active.get("id"):
-                            found = False
-                            for t2 in tokens2:
-                                if t2.get("id") == old_active["id"]:
-                                    t2["refresh_token"] = old_active.get("refresh_token", "")
-                                    t2["access_token"] = old_active.get("access_token", "")
-                                    found = True
-                                    break
-                            if not found:
+                            old_idx = self.token_manager.index_by_id(tokens2).get(old_active["id"])
+                            if old_idx is not None:
+                                tokens2[old_idx]["refresh_token"] = old_active.get("refresh_token", "")
+                                tokens2[old_idx]["access_token"] = old_active.get("access_token", "")
+                            else:
                                 old_active["status"] = "active"
                                 tokens2.insert(0, old_active)
 
                         self.token_manager.save_backup_tokens(tokens2)
+                        # 新旧激活账号的额度从此开始变化，切换前的缓存结果作废
+                        self.token_manager.invalidate_usage_cache(token_id)
+                        if old_active and old_active.get("id"):
+                            self.token_manager.invalidate_usage_cache(old_active["id"])
                         self._log(f"已切换到 [{token_id}]")
                         self._refresh_list()
                         self._check_active_async(user_initiated=False)
                     else:
                         self._log("切换失败：无法写入 auth.json")
                 finally:
-                    self._switch_inflight = False
+                    self._end_inflight("_switch_inflight")
                     self.switch_btn.config(state=tk.NORMAL)
 
             self._call_ui(continue_ui)
@@ -655,8 +867,9 @@ class TokenManagerGUI:
         if not messagebox.askyesno("确认", confirm_msg):
             return
         
+        selected_set = set(selected_ids)
         tokens = self.token_manager.load_backup_tokens()
-        tokens = [t for t in tokens if t.get("id") not in selected_ids]
+        tokens = [t for t in tokens if t.get("id") not in selected_set]
         self.token_manager.save_backup_tokens(tokens)
         
         if len(selected_ids) == 1:
@@ -678,22 +891,23 @@ class TokenManagerGUI:
         text.pack(padx=10, pady=5)
 
         def do_import():
-            lines = text.get("1.0", tk.END).strip().split("\n")
+            lines = text.get("1.0", tk.END).splitlines()
             tokens = self.token_manager.load_backup_tokens()
+            existing_rts = {(t.get("refresh_token") or "").strip() for t in tokens if t.get("refresh_token")}
             added, skipped = 0, 0
-            base_ts = int(time.time() * 1000)
             for line in lines:
-                line = line.strip()
-                if not line:
+                # 只切前两段，不为每行生成完整的 split 列表
+                rt, sep, rest = line.partition("----")
+                if not sep:
                     continue
-                parts = line.split("----")
-                if len(parts) >= 2:
-                    rt, at = parts[0].strip(), parts[1].strip()
-                    if rt and not any((t.get("refresh_token") or "").strip() == rt for t in tokens):
-                        tokens.append({"id": str(base_ts + added), "refresh_token": rt, "access_token": at, "status": "active"})
-                        added += 1
-                    elif rt:
-                        skipped += 1
+                at = rest.partition("----")[0].strip()
+                rt = rt.strip()
+                if rt and rt not in existing_rts:
+                    tokens.append({"id": self.token_manager.generate_id(), "refresh_token": rt, "access_token": at, "status": "active"})
+                    existing_rts.add(rt)
+                    added += 1
+                elif rt:
+                    skipped += 1
             self.token_manager.save_backup_tokens(tokens)
             msg = f"导入完成，新增 {added} 条"
             if skipped:
@@ -707,6 +921,7 @@ class TokenManagerGUI:
     def _toggle_monitor(self):
         if self.monitoring:
             self.monitoring = False
+            self._cancel_monitor_tick()
             self.monitor_btn.config(text="开始监控")
             self._log("监控已停止")
         else:
@@ -718,13 +933,51 @@ class TokenManagerGUI:
                 self._log(f"监控已启动 (每 {CHECK_INTERVAL / 60:.1f} 分钟)")
             # 作为“手动检查额度”的替代：开启监控时立刻查询一次
             self._check_active_async(user_initiated=True)
+            self._cancel_monitor_tick()
             self._monitor_tick()
 
+    def _poll_external_changes(self):
+        """列表直接用内存/缓存中的数据；只有文件被外部改动（与缓存版本不同）时才重新加载刷新"""
+        changed = False
+        for path in (TOKENS_FILE, FACTORY_AUTH_FILE):
+            try:
+                st = os.stat(path)
+                key = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                key = None
+            if key != self._seen_file_keys.get(path, key):
+                # 本进程写入后缓存已是新版本，不算外部改动
+                changed = changed or key != TokenManager.cached_json_key(path)
+            self._seen_file_keys[path] = key
+        if changed:
+            self._refresh_list()
+        self.root.after(EXTERNAL_CHANGE_POLL_MS, self._poll_external_changes)
+
     def _monitor_tick(self):
+        self._monitor_after_id = None
         if not self.monitoring:
             return
         self._check_active_async(user_initiated=False)
-        self.root.after(int(CHECK_INTERVAL * 1000), self._monitor_tick)
+        self._monitor_after_id = self.root.after(int(self._next_check_delay() * 1000), self._monitor_tick)
+
+    def _next_check_delay(self) -> float:
+        """下一次监控检查的间隔：平时按 CHECK_INTERVAL 查额度，token 快过期时提前到过期前检查"""
+        active = self.token_manager.load_active_token()
+        exp = TokenManager.jwt_exp(active.get("access_token", "")) if active else None
+        if exp is None:
+            return CHECK_INTERVAL
+        remaining = exp - time.time()
+        if remaining <= 0:
+            # 已过期说明刷新一直失败，按常规间隔重试，不要对失效账号高频发刷新请求
+            return CHECK_INTERVAL
+        until_renew = remaining - TOKEN_EXPIRY_MARGIN + RENEW_TICK_SLACK
+        return min(CHECK_INTERVAL, max(MIN_CHECK_INTERVAL, until_renew))
+
+    def _cancel_monitor_tick(self):
+        """取消已排队的下一次监控检查，避免反复开关监控后叠加多个定时器"""
+        if self._monitor_after_id:
+            self.root.after_cancel(self._monitor_after_id)
+            self._monitor_after_id = None
 
     def _toggle_log_monitor(self):
         """切换日志监控状态"""
@@ -735,24 +988,61 @@ class TokenManagerGUI:
             self.log_monitor.start_monitoring()
             self.log_monitor_btn.config(text="停止日志监控")
 
+    def _show_pooled_notification(self, key: str, title: str, geometry: str, lines: list, hide_after_ms: int):
+        """显示通知窗口：同类通知复用同一个 Toplevel，超时后隐藏而不是销毁
+
+        lines 为 [(text, font, pady), ...]，行数需与首次创建时一致。
+        """
+        entry = self._notification_windows.get(key)
+        if entry is None or not entry["window"].winfo_exists():
+            window = tk.Toplevel(self.root)
+            window.title(title)
+            window.geometry(geometry)
+            window.transient(self.root)
+            # 设置窗口始终在最前面
+            window.attributes('-topmost', True)
+            # 用户手动关闭时同样只隐藏
+            window.protocol("WM_DELETE_WINDOW", window.withdraw)
+
+            labels = []
+            for text, font, pady in lines:
+                label = ttk.Label(window, text=text, font=font)
+                label.pack(pady=pady)
+                labels.append(label)
+
+            def on_destroy(event, key=key, window=window):
+                if event.widget is window:
+                    self._notification_windows.pop(key, None)
+
+            window.bind("<Destroy>", on_destroy)
+            entry = {"window": window, "labels": labels, "hide_id": None}
+            self._notification_windows[key] = entry
+        else:
+            window = entry["window"]
+            for label, (text, _, _) in zip(entry["labels"], lines):
+                label.config(text=text)
+            window.deiconify()
+            window.lift()
+            if entry["hide_id"]:
+                window.after_cancel(entry["hide_id"])
+
+        entry["hide_id"] = window.after(hide_after_ms, window.withdraw)
+
     def _prompt_user_continue(self, token_id):
         """提示用户在CLI中继续工作"""
         def show_notification():
-            # 创建简单的通知窗口，不要求输入
-            notification_window = tk.Toplevel(self.root)
-            notification_window.title("账号已切换")
-            notification_window.geometry("400x120")
-            notification_window.transient(self.root)
-            
-            # 设置窗口始终在最前面
-            notification_window.attributes('-topmost', True)
-            
-            ttk.Label(notification_window, text="💰 检测到付款错误", font=("", 12, "bold")).pack(pady=10)
-            ttk.Label(notification_window, text=f"已自动切换到账号: [{token_id}]", font=("", 10)).pack(pady=5)
-            ttk.Label(notification_window, text="请在命令行中输入 '继续' 以继续工作", font=("", 10, "italic")).pack(pady=5)
-            
-            # 10秒后自动关闭
-            notification_window.after(10000, notification_window.destroy)
+            # 简单的通知窗口，不要求输入；10秒后自动隐藏
+            self._show_pooled_notification(
+                "auto_switch",
+                "账号已切换",
+                "400x120",
+                [
+                    ("💰 检测到付款错误", ("", 12, "bold"), 10),
+                    (f"已自动切换到账号: [{token_id}]", ("", 10), 5),
+                    ("请在命令行中输入 '继续' 以继续工作", ("", 10, "italic"), 5),
+                ],
+                10000,
+            )
             
             # 同时在GUI日志中显示提示
             self._log_safe("=" * 50)
@@ -769,16 +1059,16 @@ class TokenManagerGUI:
     def _show_error_notification(self):
         """显示错误通知"""
         def show_error():
-            error_window = tk.Toplevel(self.root)
-            error_window.title("切换失败")
-            error_window.geometry("400x100")
-            error_window.transient(self.root)
-            error_window.attributes('-topmost', True)
-            
-            ttk.Label(error_window, text="❌ 自动切换失败", font=("", 12, "bold")).pack(pady=10)
-            ttk.Label(error_window, text="请手动切换账号或充值", font=("", 10)).pack(pady=5)
-            
-            error_window.after(5000, error_window.destroy)
+            self._show_pooled_notification(
+                "switch_error",
+                "切换失败",
+                "400x100",
+                [
+                    ("❌ 自动切换失败", ("", 12, "bold"), 10),
+                    ("请手动切换账号或充值", ("", 10), 5),
+                ],
+                5000,
+            )
         
         self._call_ui(show_error)
         self.cli_prompt.show_error_message("自动切换失败")
@@ -786,21 +1076,18 @@ class TokenManagerGUI:
     def _show_switch_notification(self, token_id):
         """显示账号切换通知"""
         def show_notification():
-            # 创建简单的通知窗口
-            notification_window = tk.Toplevel(self.root)
-            notification_window.title("账号已切换")
-            notification_window.geometry("400x120")
-            notification_window.transient(self.root)
-            
-            # 设置窗口始终在最前面
-            notification_window.attributes('-topmost', True)
-            
-            ttk.Label(notification_window, text="💰 当前账号无余额", font=("", 12, "bold")).pack(pady=10)
-            ttk.Label(notification_window, text=f"已切换到有余额账号: [{token_id}]", font=("", 10)).pack(pady=5)
-            ttk.Label(notification_window, text="可以继续工作", font=("", 10, "italic")).pack(pady=5)
-            
-            # 5秒后自动关闭
-            notification_window.after(5000, notification_window.destroy)
+            # 5秒后自动隐藏
+            self._show_pooled_notification(
+                "switched",
+                "账号已切换",
+                "400x120",
+                [
+                    ("💰 当前账号无余额", ("", 12, "bold"), 10),
+                    (f"已切换到有余额账号: [{token_id}]", ("", 10), 5),
+                    ("可以继续工作", ("", 10, "italic"), 5),
+                ],
+                5000,
+            )
         
         self._call_ui(show_notification)
 
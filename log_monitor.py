@@ -3,42 +3,92 @@
 """日志监控模块"""
 
 import os
-import re
 import time
 import threading
-import glob
 from pathlib import Path
 
+# watchdog 为可选依赖：安装后由文件系统事件（inotify / ReadDirectoryChangesW）唤醒，
+# 未安装时退回按秒轮询
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+POLL_INTERVAL = 1
+MAX_READ_CHUNK = 1 << 20
+LOG_FILES_CACHE_TTL = 30
+# 跨块保留的未完成行上限，足以容纳一整行提示
+MAX_TAIL_CARRY = 4096
+# 事件驱动模式下的兜底检查间隔，防止个别平台/网络盘漏发事件
+WATCH_FALLBACK_INTERVAL = 30
+# 最多记住多少个被改名轮转走的文件的读取位置
+MAX_MOVED_FILES = 16
+
+
+class _LogChangeHandler(FileSystemEventHandler):
+    """日志目录有变化时唤醒监控线程；有文件新建/移入时另外通知重新查找日志文件"""
+
+    def __init__(self, wake_event, rescan_event):
+        super().__init__()
+        self.wake_event = wake_event
+        self.rescan_event = rescan_event
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        if event.event_type in ("created", "moved"):
+            self.rescan_event.set()
+        self.wake_event.set()
+
 
 class LogMonitor:
     """日志监控类"""
+
+    POSSIBLE_LOG_PATHS = [
+        'C:/Users/Administrator/.factory/logs/*.log'  # 用户指定的实际日志位置
+    ]
+    EXPANDED_LOG_PATHS = [os.path.expanduser(p) for p in POSSIBLE_LOG_PATHS]
     
     def __init__(self, callback=None):
         self.callback = callback
         self.monitoring = False
         self.monitor_thread = None
-        self.payment_error_pattern = re.compile(
-            r'Ready for more\? Reload your tokens.*?https://app\.factory\.ai/settings/billing'
-        )
+        # “无余额”提示的两段固定文本，用子串查找代替带 .*? 的正则
+        self._needle_a = b"Ready for more? Reload your tokens"
+        self._needle_b = b"https://app.factory.ai/settings/billing"
         self.log_file_positions = {}
+        self._tail_carry = {}
+        # 记录每个日志文件的 (st_dev, st_ino)，用于识别轮转
+        self._file_ids = {}
+        # 已离开原路径（被改名轮转或被替换）的文件的读取状态：{(st_dev, st_ino): (位置, 未完成行)}
+        # 该文件以新名字再次被发现时接着读，不重复扫描已处理过的内容
+        self._moved_files = {}
+        # (monotonic 时间, 日志文件列表)
+        self._log_files_cache = (0.0, [])
+        # 每次启动监控都新建一对事件，旧线程即使尚未退出也不会被新一轮监控“复活”
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
     
     def find_droid_log_files(self):
-        """查找 Droid 客户端日志文件"""
-        possible_paths = [
-            'C:/Users/Administrator/.factory/logs/*.log'  # 用户指定的实际日志位置
-        ]
-        
-        found_logs = []
-        for path in possible_paths:
+        """查找 Droid 客户端日志文件（结果缓存 LOG_FILES_CACHE_TTL 秒）"""
+        ts, cached = self._log_files_cache
+        if cached and time.monotonic() - ts < LOG_FILES_CACHE_TTL:
+            return list(cached)
+
+        found_logs = set()
+        for path in self.EXPANDED_LOG_PATHS:
             if '*' in path:
-                expanded_path = os.path.expanduser(path)
-                found_logs.extend(glob.glob(expanded_path))
-            else:
-                expanded_path = os.path.expanduser(path)
-                if os.path.exists(expanded_path):
-                    found_logs.append(expanded_path)
-        
-        return found_logs
+                directory, pattern = os.path.split(path)
+                found_logs.update(str(p) for p in Path(directory).glob(pattern))
+            elif os.path.exists(path):
+                found_logs.add(path)
+
+        # 同一文件可能经不同路径写法匹配到多次，按真实路径去重
+        result = sorted({os.path.realpath(p) for p in found_logs})
+        self._log_files_cache = (time.monotonic(), result)
+        return list(result)
 
     def start_monitoring(self):
         """启动日志监控"""
@@ -46,7 +96,11 @@ class LogMonitor:
             return
         
         self.monitoring = True
-        self.monitor_thread = threading.Thread(target=self._monitor_logs_worker, daemon=True)
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self.monitor_thread = threading.Thread(
+            target=self._monitor_logs_worker, args=(self._wake, self._stop_event), daemon=True
+        )
         self.monitor_thread.start()
         
         if self.callback:
@@ -55,13 +109,16 @@ class LogMonitor:
     def stop_monitoring(self):
         """停止日志监控"""
         self.monitoring = False
+        self._stop_event.set()
+        # 立即唤醒工作线程，而不是等它睡完当前间隔
+        self._wake.set()
         if self.monitor_thread:
             self.monitor_thread.join(timeout=1)
         
         if self.callback:
             self.callback("log", "日志监控已停止")
 
-    def _monitor_logs_worker(self):
+    def _monitor_logs_worker(self, wake, stop_event):
         """日志监控工作线程"""
         log_files = self.find_droid_log_files()
         
@@ -76,40 +133,173 @@ class LogMonitor:
         # 初始化文件位置
         for log_file in log_files:
             try:
-                self.log_file_positions[log_file] = os.path.getsize(log_file)
+                st = os.stat(log_file)
+                self.log_file_positions[log_file] = st.st_size
+                self._file_ids[log_file] = (st.st_dev, st.st_ino)
             except:
                 self.log_file_positions[log_file] = 0
         
-        while self.monitoring:
+        rescan = threading.Event()
+        observer = self._start_observer(log_files, wake, rescan)
+        interval = WATCH_FALLBACK_INTERVAL if observer else POLL_INTERVAL
+        try:
+            while not stop_event.is_set():
+                try:
+                    if rescan.is_set():
+                        rescan.clear()
+                        # 新建的日志文件不能被查找缓存挡住
+                        self._log_files_cache = (0.0, [])
+                    # 轮询模式下靠缓存过期定期发现新文件
+                    log_files = self._update_log_files(log_files)
+                    for log_file in log_files:
+                        self._check_log_updates(log_file)
+                    # 有文件事件或停止监控时立即醒来，否则按间隔兜底检查
+                    wake.wait(interval)
+                    wake.clear()
+                except Exception as e:
+                    if self.callback:
+                        self.callback("log", f"日志监控出错: {e}")
+                    stop_event.wait(5)
+        finally:
+            self._stop_observer(observer)
+
+    def _update_log_files(self, log_files):
+        """重新查找日志文件：改名轮转过来的文件接着原位置读，真正新建的文件从头读"""
+        current = self.find_droid_log_files()
+        if current == log_files:
+            return log_files
+        known = set(log_files)
+        # 先收起已消失路径的读取状态，改名后的新路径可按 inode 接上
+        for log_file in known.difference(current):
+            position = self.log_file_positions.pop(log_file, 0)
+            carry = self._tail_carry.pop(log_file, b"")
+            file_id = self._file_ids.pop(log_file, None)
+            if file_id is not None:
+                self._remember_moved(file_id, position, carry)
+        # 旧名字已被新文件占用、但尚未检查到替换时，文件的读取状态还挂在旧名字下
+        known_ids = {self._file_ids.get(p): p for p in known.intersection(current)}
+        for log_file in current:
+            if log_file in known:
+                continue
             try:
-                for log_file in log_files:
-                    self._check_log_updates(log_file)
-                time.sleep(1)  # 每秒检查一次
-            except Exception as e:
-                if self.callback:
-                    self.callback("log", f"日志监控出错: {e}")
-                time.sleep(5)
+                st = os.stat(log_file)
+                file_id = (st.st_dev, st.st_ino)
+            except OSError:
+                file_id = None
+            old_name = known_ids.pop(file_id, None) if file_id is not None else None
+            if old_name is not None:
+                # 旧名字下现在是另一个文件，从头读
+                position = self.log_file_positions.get(old_name, 0)
+                carry = self._tail_carry.pop(old_name, b"")
+                self.log_file_positions[old_name] = 0
+                self._file_ids.pop(old_name, None)
+            else:
+                position, carry = self._moved_files.pop(file_id, (0, b""))
+            self.log_file_positions[log_file] = position
+            if file_id is not None:
+                self._file_ids[log_file] = file_id
+            else:
+                self._file_ids.pop(log_file, None)
+            if carry:
+                self._tail_carry[log_file] = carry
+            else:
+                self._tail_carry.pop(log_file, None)
+            if self.callback:
+                self.callback("log", f"发现新日志文件: {log_file}")
+        return current
+
+    def _remember_moved(self, file_id, position, carry):
+        """记下离开原路径的文件读到的位置；只保留最近几个，避免无限增长"""
+        self._moved_files[file_id] = (position, carry)
+        while len(self._moved_files) > MAX_MOVED_FILES:
+            self._moved_files.pop(next(iter(self._moved_files)))
+
+    def _start_observer(self, log_files, wake, rescan):
+        """为日志所在目录注册文件系统事件监听，返回 observer；不可用时返回 None"""
+        if Observer is None:
+            return None
+        try:
+            observer = Observer()
+            handler = _LogChangeHandler(wake, rescan)
+            # 每个目录只注册一次，控制 watch 数量
+            for directory in {os.path.dirname(p) for p in log_files}:
+                observer.schedule(handler, directory, recursive=False)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            if self.callback:
+                self.callback("log", f"文件事件监听启动失败，改为轮询: {e}")
+            return None
+        return observer
+
+    @staticmethod
+    def _stop_observer(observer):
+        if observer:
+            try:
+                observer.stop()
+                observer.join(timeout=1)
+            except Exception:
+                pass
 
     def _check_log_updates(self, log_file):
         """检查单个日志文件的更新"""
         try:
-            current_size = os.path.getsize(log_file)
+            st = os.stat(log_file)
+            current_size = st.st_size
             last_size = self.log_file_positions.get(log_file, 0)
-            
+            file_id = (st.st_dev, st.st_ino)
+            known_id = self._file_ids.get(log_file)
+            self._file_ids[log_file] = file_id
+
+            if known_id is not None and known_id != file_id:
+                # 同名文件已被轮转替换，从头读新文件；旧文件可能以新名字继续出现
+                self._remember_moved(known_id, last_size, self._tail_carry.pop(log_file, b""))
+                last_size = 0
+            elif current_size < last_size:
+                # 文件被截断，从头开始读
+                last_size = 0
+                self._tail_carry.pop(log_file, None)
+
             if current_size > last_size:
-                with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
+                found = False
+                carry = self._tail_carry.get(log_file, b"")
+                with open(log_file, 'rb') as f:
                     f.seek(last_size)
-                    new_content = f.read()
-                    
-                    if self.payment_error_pattern.search(new_content):
-                        if self.callback:
-                            self.callback("payment_error", "检测到账号无余额，正在自动切换账号...")
-                
-                self.log_file_positions[log_file] = current_size
+                    remaining = current_size - last_size
+                    # 分块读取，单次内存占用不超过 MAX_READ_CHUNK
+                    while remaining > 0:
+                        chunk = f.read(min(remaining, MAX_READ_CHUNK))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        buf = carry + chunk
+                        if not found and self._has_payment_error(buf):
+                            found = True
+                        # 提示按行匹配，把末尾未结束的半行带到下一块
+                        carry = buf[buf.rfind(b"\n") + 1:][-MAX_TAIL_CARRY:]
+
+                # 已触发过的半行不再带入下一次检查，避免同一行重复触发
+                self._tail_carry[log_file] = b"" if found else carry
+                if found and self.callback:
+                    self.callback("payment_error", "检测到账号无余额，正在自动切换账号...")
+
+            self.log_file_positions[log_file] = current_size
         except Exception as e:
             if self.callback:
                 self.callback("log", f"检查日志文件 {log_file} 出错: {e}")
 
+    def _has_payment_error(self, content: bytes) -> bool:
+        """同一行内先出现提示语、后出现充值链接即视为无余额"""
+        idx = content.find(self._needle_a)
+        while idx != -1:
+            line_end = content.find(b"\n", idx)
+            if line_end == -1:
+                line_end = len(content)
+            if content.find(self._needle_b, idx + len(self._needle_a), line_end) != -1:
+                return True
+            idx = content.find(self._needle_a, line_end)
+        return False
+
     def is_monitoring(self):
         """返回监控状态"""
         return self.monitoring
@@ -2,14 +2,30 @@
 # -*- coding: utf-8 -*-
 """Token 管理核心逻辑模块"""
 
+import atexit
+import base64
+import copy
+import heapq
+import itertools
 import json
 import os
+import shutil
 import sys
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson 为可选依赖（C 实现，解析/序列化更快），未安装时使用标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # exe 运行时用 exe 所在目录，否则用脚本目录
 if getattr(sys, 'frozen', False):
@@ -23,25 +39,136 @@ REFRESH_URL = "https://api.workos.com/user_management/authenticate"
 USAGE_URL = "https://app.factory.ai/api/organization/members/chat-usage"
 CLIENT_ID = "client_01HNM792M5G5G1A2THWPXKFMXB"
 WARN_THRESHOLD = 0.9
+# 自动切换时并发验证的候选账号数及单次查询超时（秒）
+AUTO_SWITCH_CANDIDATES = 3
+AUTO_SWITCH_TIMEOUT = 10
+# 备用池写盘防抖时间（秒）：短时间内多次保存只落盘最后一次
+SAVE_DEBOUNCE = 0.3
+# 写盘失败后隔多久重试（秒），期间内存中的修改继续作为最新内容
+SAVE_RETRY_DELAY = 5
+# 额度查询结果的缓存时间（秒），以及 access_token 剩余有效期低于多少秒时直接刷新
+USAGE_CACHE_TTL = 60
+TOKEN_EXPIRY_MARGIN = 30
+# 额度查询返回这些状态码时才认为 access_token 失效、需要刷新
+REFRESH_ON_STATUS = (401, 403)
+HTTP_POOL_MAXSIZE = 16
+# 同一 refresh_token 的刷新结果在完成后保留的秒数，迟到的并发调用直接复用
+REFRESH_COALESCE_GRACE = 5
+# 刷新请求体中只有 refresh_token 会变化，其余部分预先编码好
+_REFRESH_BODY_TMPL = f"grant_type=refresh_token&client_id={quote(CLIENT_ID, safe='')}&refresh_token=%s".encode("ascii")
+_REFRESH_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+# 临时文件名用：pid 只取一次；itertools.count 的 next() 在 GIL 下是原子的
+_PID = os.getpid()
+_TMP_COUNTER = itertools.count()
+
+
+def _json_loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _json_dumps(data) -> bytes:
+    """序列化为 UTF-8 字节，格式与 json.dump(indent=2, ensure_ascii=False) 一致"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _copy_json(data):
+    """复制 tokens.json / auth.json 的解析结果。备用池条目都是只含标量的扁平 dict，
+    逐条浅拷贝即可让调用方随意修改，比 deepcopy 快一个数量级"""
+    if isinstance(data, list):
+        return [dict(t) if isinstance(t, dict) else t for t in data]
+    if isinstance(data, dict):
+        return {k: _copy_json(v) if isinstance(v, list) else v for k, v in data.items()}
+    return data
+
+
+def _build_session() -> requests.Session:
+    """创建共享会话：复用 TCP/TLS 连接，并对限流/服务端错误做少量退避重试"""
+    session = requests.Session()
+    # Retry 默认不重试 POST：refresh_token 会轮换，重复提交可能让旧 token 作废
+    # 只对限流/服务端错误状态码重试；连接失败与读超时不重试，否则每次重试都再等满 timeout，
+    # 调用方给的超时（如 AUTO_SWITCH_TIMEOUT）会被放大数倍。也不按 Retry-After 长时间等待
+    retry = Retry(
+        total=2,
+        connect=0,
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=False,
+    )
+    # 每个主机的连接池要容纳 GUI 批量检查、自动切换候选验证与定时查询同时在途的请求，
+    # 否则多出的连接用完即被丢弃，又回到每次重新握手
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session.mount("https://", adapter)
+    # requests 默认已带 Accept-Encoding: gzip, deflate 并自动解压；这里显式声明，避免被覆盖默认头时丢失
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0",
+        "Connection": "keep-alive",
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+    })
+    return session
 
 
 class TokenManager:
     """Token 管理核心类"""
+
+    # 已解析 JSON 文件的进程内缓存：{path: ((mtime_ns, size), data)}
+    # GUI 线程、日志监控线程与查询线程会同时读写，用锁保护
+    _json_cache = {}
+    _json_cache_lock = threading.Lock()
+    # 所有 HTTP 请求共用一个会话（requests.Session 可跨线程并发使用）
+    _session = _build_session()
+    # 尚未落盘的备用池内容及其防抖定时器
+    _pending_tokens = None
+    _flush_timer = None
+    _flush_lock = threading.RLock()
+    # 最近一次成功的额度查询：{token_id: (monotonic 时间, ratio, info)}
+    _usage_cache = {}
+    _usage_cache_lock = threading.Lock()
+    # 进行中的刷新：{rt: Event}；最近的刷新结果：{rt: (monotonic 时间, payload)}
+    _refresh_inflight = {}
+    _refresh_results = {}
+    _refresh_mutex = threading.Lock()
+    # 最近一次生成的 ID（毫秒），用于保证 generate_id 单调递增
+    _last_id_ms = 0
+    # 解析失败的 tokens.json 的 (mtime_ns, size)，文件不变时不再重复解析
+    _tokens_corrupt_key = None
+    # 尚未被界面取走的警告
+    _warnings = []
+    _warnings_lock = threading.Lock()
+    # jwt_exp 最近一次的 (access_token, exp)
+    _jwt_exp_memo = (None, None)
+    _id_lock = threading.Lock()
     
     def __init__(self):
         self._switch_inflight = False
         self._last_active_ratio = None
     
     @staticmethod
-    def atomic_write_json(path: Path, data) -> bool:
-        """原子写入 JSON，避免写入中断导致文件损坏。"""
+    def atomic_write_json(path: Path, data, backup: bool = False) -> bool:
+        """原子写入 JSON，避免写入中断导致文件损坏。backup 为 True 时先把旧文件留存为 .bak"""
         tmp_path = None
         try:
             path.parent.mkdir(parents=True, exist_ok=True)
-            tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}-{int(time.time() * 1000)}")
-            with open(tmp_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            # 进程内递增序号保证多线程同时写同一文件时临时文件名也不冲突
+            tmp_path = path.with_name(f"{path.name}.tmp-{_PID}-{next(_TMP_COUNTER)}")
+            with open(tmp_path, "wb") as f:
+                f.write(_json_dumps(data))
+                # 数据先落盘再 rename，断电后不会出现空文件或半截文件
+                f.flush()
+                os.fsync(f.fileno())
+                # rename 不改变 mtime/size，替换前取到的即是目标文件替换后的状态
+                st = os.fstat(f.fileno())
+            if backup:
+                TokenManager._backup_if_valid(path)
             os.replace(tmp_path, path)
+            TokenManager._fsync_dir(path.parent)
+            TokenManager._remember_json(path, (st.st_mtime_ns, st.st_size), data)
             return True
         except Exception:
             try:
@@ -51,56 +178,213 @@ class TokenManager:
                 pass
             return False
 
+    @staticmethod
+    def _backup_if_valid(path: Path):
+        """把当前文件复制为 .bak；只备份确认能解析的版本（与缓存的 mtime/size 一致），免得损坏文件覆盖好备份"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with TokenManager._json_cache_lock:
+            cached = TokenManager._json_cache.get(path)
+        if not cached or cached[0] != (st.st_mtime_ns, st.st_size):
+            return
+        try:
+            shutil.copy2(path, path.with_name(path.name + ".bak"))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _fsync_dir(directory: Path):
+        """同步目录项，使 rename 本身也能在断电后保留；Windows 不支持对目录 fsync，直接跳过"""
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    @staticmethod
+    def _remember_json(path: Path, key: tuple, data):
+        with TokenManager._json_cache_lock:
+            TokenManager._json_cache[path] = (key, _copy_json(data))
+
+    @staticmethod
+    def read_json_cached(path: Path):
+        """读取 JSON 文件；文件 mtime/size 未变化时直接返回缓存的解析结果（副本）"""
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with TokenManager._json_cache_lock:
+            cached = TokenManager._json_cache.get(path)
+        if cached and cached[0] == key:
+            return _copy_json(cached[1])
+        with open(path, "rb") as f:
+            # 以实际读到的这份文件的状态作为缓存键，stat 与 open 之间文件被替换也不会错配
+            st = os.fstat(f.fileno())
+            key = (st.st_mtime_ns, st.st_size)
+            data = _json_loads(f.read())
+        TokenManager._remember_json(path, key, data)
+        return data
+
+    @staticmethod
+    def cached_json_key(path: Path) -> tuple | None:
+        """返回缓存中该文件的 (mtime_ns, size)；与磁盘上的不一致说明文件被外部修改过"""
+        with TokenManager._json_cache_lock:
+            cached = TokenManager._json_cache.get(path)
+        return cached[0] if cached else None
+
+    @staticmethod
+    def index_by_id(tokens: list) -> dict[str, int]:
+        """构建 id -> 下标 的索引（id 重复时保留第一个，与顺序查找一致）；id 已在加载时统一为 str"""
+        index = {}
+        for i, t in enumerate(tokens):
+            index.setdefault(t.get("id", ""), i)
+        return index
+
     @staticmethod
     def generate_id() -> str:
-        """生成唯一 ID（时间戳）"""
-        return str(int(time.time() * 1000))
+        """生成唯一 ID（毫秒时间戳）；同一毫秒内或时钟回拨时顺延 1，保证进程内不重复"""
+        with TokenManager._id_lock:
+            ms = max(time.time_ns() // 1_000_000, TokenManager._last_id_ms + 1)
+            TokenManager._last_id_ms = ms
+        return str(ms)
 
     @staticmethod
     def load_backup_tokens():
         """加载备用账号池"""
+        with TokenManager._flush_lock:
+            # 有尚未落盘的修改时以内存中的为准
+            if TokenManager._pending_tokens is not None:
+                return _copy_json(TokenManager._pending_tokens)
         if not TOKENS_FILE.exists():
             TokenManager.save_backup_tokens([])
             return []
         try:
-            with open(TOKENS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, dict) and "tokens" in data:
-                    return data["tokens"]
-                return data if isinstance(data, list) else []
+            data = TokenManager._read_tokens_file()
+            if isinstance(data, dict) and "tokens" in data:
+                data = data["tokens"]
+            return TokenManager._normalize_ids(data) if isinstance(data, list) else []
         except Exception:
             return []
 
+    @staticmethod
+    def _read_tokens_file():
+        """读取 tokens.json；无法解析时改读 .bak（没有 .bak 则视为空）。同一份损坏文件只解析一次"""
+        bak = TOKENS_FILE.with_name(TOKENS_FILE.name + ".bak")
+        if TokenManager._tokens_corrupt_key is not None:
+            st = os.stat(TOKENS_FILE)
+            if (st.st_mtime_ns, st.st_size) == TokenManager._tokens_corrupt_key:
+                return TokenManager.read_json_cached(bak) if bak.exists() else []
+            TokenManager._tokens_corrupt_key = None
+        try:
+            return TokenManager.read_json_cached(TOKENS_FILE)
+        except ValueError:
+            pass
+        st = os.stat(TOKENS_FILE)
+        TokenManager._tokens_corrupt_key = (st.st_mtime_ns, st.st_size)
+        # 损坏的原文件另存一份留作排查，不直接覆盖
+        corrupt = TOKENS_FILE.with_name(f"{TOKENS_FILE.name}.corrupt-{st.st_mtime_ns}")
+        try:
+            shutil.copy2(TOKENS_FILE, corrupt)
+            message = f"{TOKENS_FILE.name} 解析失败，已另存为 {corrupt.name}"
+        except OSError:
+            message = f"{TOKENS_FILE.name} 解析失败"
+        if not bak.exists():
+            TokenManager._add_warning(f"{message}，且没有可用的 {bak.name} 备份，账号列表为空")
+            return []
+        TokenManager._add_warning(f"{message}，改用 {bak.name} 备份")
+        return TokenManager.read_json_cached(bak)
+
+    @staticmethod
+    def _add_warning(message: str):
+        with TokenManager._warnings_lock:
+            TokenManager._warnings.append(message)
+
+    @staticmethod
+    def pop_warnings() -> list[str]:
+        """取出后台读写过程中积累的警告，交给界面显示"""
+        with TokenManager._warnings_lock:
+            warnings, TokenManager._warnings = TokenManager._warnings, []
+        return warnings
+
+    @staticmethod
+    def _normalize_ids(tokens: list) -> list:
+        """把手工编辑留下的数字 id 统一成 str，之后的比较和索引无需再逐个 str()"""
+        for t in tokens:
+            if "id" in t and not isinstance(t["id"], str):
+                t["id"] = str(t["id"])
+        return tokens
+
     @staticmethod
     def save_backup_tokens(tokens: list):
-        """保存备用账号池"""
-        TokenManager.atomic_write_json(TOKENS_FILE, tokens)
+        """保存备用账号池（防抖：SAVE_DEBOUNCE 秒内的连续保存合并为一次写盘）"""
+        with TokenManager._flush_lock:
+            TokenManager._pending_tokens = _copy_json(tokens)
+            TokenManager._arm_flush_timer(SAVE_DEBOUNCE)
+
+    @staticmethod
+    def _arm_flush_timer(delay: float):
+        """（重新）安排一次延迟写盘；调用方需持有 _flush_lock"""
+        if TokenManager._flush_timer:
+            TokenManager._flush_timer.cancel()
+        timer = threading.Timer(delay, TokenManager.flush_pending_tokens)
+        timer.daemon = True
+        TokenManager._flush_timer = timer
+        timer.start()
+
+    @staticmethod
+    def flush_pending_tokens():
+        """立即把尚未落盘的备用池写入文件"""
+        with TokenManager._flush_lock:
+            if TokenManager._flush_timer:
+                TokenManager._flush_timer.cancel()
+                TokenManager._flush_timer = None
+            tokens = TokenManager._pending_tokens
+            if tokens is None:
+                return True
+            # 在锁内写盘，保证写入完成前的读取仍能拿到内存中的最新内容
+            if TokenManager.atomic_write_json(TOKENS_FILE, tokens, backup=True):
+                TokenManager._pending_tokens = None
+                return True
+            # 写盘失败时保留内存中的修改（可能含已轮换的 refresh_token），稍后重试
+            TokenManager._arm_flush_timer(SAVE_RETRY_DELAY)
+            return False
 
     @staticmethod
     def load_active_token():
         """从 ~/.factory/auth.json 读取当前激活的 token"""
-        if not FACTORY_AUTH_FILE.exists():
-            return None
         try:
-            with open(FACTORY_AUTH_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                rt = data.get("refresh_token", "").strip()
-                at = data.get("access_token", "").strip()
-                token_id = data.get("id", "")
-                if rt or at:
-                    return {"id": token_id, "refresh_token": rt, "access_token": at}
+            data = TokenManager._load_auth_dict()
+            rt = data.get("refresh_token", "").strip()
+            at = data.get("access_token", "").strip()
+            token_id = data.get("id", "")
+            if not isinstance(token_id, str):
+                token_id = str(token_id)
+            if rt or at:
+                return {"id": token_id, "refresh_token": rt, "access_token": at}
         except Exception:
             pass
         return None
 
+    @staticmethod
+    def _load_auth_dict() -> dict:
+        """读取 auth.json 的完整内容（走 mtime 缓存）；文件不存在时返回空 dict"""
+        try:
+            return TokenManager.read_json_cached(FACTORY_AUTH_FILE)
+        except FileNotFoundError:
+            return {}
+
     @staticmethod
     def save_active_token(token_info: dict):
         """保存 token 到 ~/.factory/auth.json"""
         try:
-            auth_data = {}
-            if FACTORY_AUTH_FILE.exists():
-                with open(FACTORY_AUTH_FILE, "r", encoding="utf-8") as f:
-                    auth_data = json.load(f)
+            auth_data = TokenManager._load_auth_dict()
             
             auth_data["access_token"] = token_info.get("access_token", "")
             auth_data["refresh_token"] = token_info.get("refresh_token", "")
@@ -113,15 +397,52 @@ class TokenManager:
 
     @staticmethod
     def refresh_token(rt: str, timeout: float = 30) -> dict | None:
+        """刷新 token。同一 refresh_token 的并发调用合并为一次请求，共享结果"""
+        with TokenManager._refresh_mutex:
+            recent = TokenManager._refresh_results.get(rt)
+            # 只有带 access_token 的成功结果才在宽限期内复用；失败（含服务端返回的错误 JSON）只分给同一批等待者
+            if (recent and isinstance(recent[1], dict) and recent[1].get("access_token")
+                    and time.monotonic() - recent[0] < REFRESH_COALESCE_GRACE):
+                return copy.deepcopy(recent[1])
+            event = TokenManager._refresh_inflight.get(rt)
+            leader = event is None
+            if leader:
+                event = TokenManager._refresh_inflight[rt] = threading.Event()
+
+        if not leader:
+            if not event.wait(timeout):
+                return None
+            with TokenManager._refresh_mutex:
+                recent = TokenManager._refresh_results.get(rt)
+            return copy.deepcopy(recent[1]) if recent else None
+
+        payload = None
+        try:
+            payload = TokenManager._post_refresh(rt, timeout)
+            return copy.deepcopy(payload)
+        finally:
+            now = time.monotonic()
+            with TokenManager._refresh_mutex:
+                # 顺带清理过期结果，避免字典无限增长
+                for key in [k for k, (ts, _) in TokenManager._refresh_results.items()
+                            if now - ts >= REFRESH_COALESCE_GRACE]:
+                    del TokenManager._refresh_results[key]
+                TokenManager._refresh_results[rt] = (now, payload)
+                TokenManager._refresh_inflight.pop(rt, None)
+            event.set()
+
+    @staticmethod
+    def _post_refresh(rt: str, timeout: float) -> dict | None:
+        """向 WorkOS 发起一次刷新请求"""
         try:
-            resp = requests.post(
+            resp = TokenManager._session.post(
                 REFRESH_URL,
-                data={"grant_type": "refresh_token", "refresh_token": rt, "client_id": CLIENT_ID},
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                data=_REFRESH_BODY_TMPL % quote(rt, safe="").encode("ascii"),
+                headers=_REFRESH_HEADERS,
                 timeout=timeout,
             )
             try:
-                payload = resp.json()
+                payload = _json_loads(resp.content)
             except Exception:
                 return None
 
@@ -131,34 +452,87 @@ class TokenManager:
             return None
 
     @staticmethod
-    def _do_query(access_token: str, timeout: float = 30) -> tuple[float, dict]:
-        """内部查询函数，仅用 access_token 查询一次"""
+    def _do_query(access_token: str, timeout: float = 30) -> tuple[float, dict, int | None]:
+        """内部查询函数，仅用 access_token 查询一次。返回 (ratio, info, HTTP 状态码)，网络错误时状态码为 None"""
+        status = None
         try:
-            resp = requests.get(
+            # 429/5xx 已由会话的 Retry 策略退避重试
+            resp = TokenManager._session.get(
                 USAGE_URL,
-                headers={"Authorization": f"Bearer {access_token}", "User-Agent": "Mozilla/5.0"},
+                headers={"Authorization": f"Bearer {access_token}"},
                 timeout=timeout,
             )
+            status = resp.status_code
             if resp.ok:
-                data = resp.json()
+                # 直接解析原始字节：跳过 resp.json() 的编码探测与整段解码为 str，装了 orjson 时也走 orjson
+                data = _json_loads(resp.content)
                 if "usage" in data:
                     usage = data["usage"].get("standard", {})
                     total = usage.get("totalAllowance", 0)
                     used = usage.get("orgTotalTokensUsed", 0)
                     remain = total - used
                     ratio = used / total if total > 0 else 0
-                    return ratio, {"total": total, "used": used, "remain": remain}
+                    return ratio, {"total": total, "used": used, "remain": remain}, status
         except Exception:
             pass
-        return -1, {}
+        return -1, {}, status
+
+    @staticmethod
+    def jwt_exp(access_token: str) -> int | None:
+        """读取 JWT 中的 exp（不校验签名，只用来决定是否先刷新）；不是 JWT 时返回 None"""
+        # 只记住最近一个 token 的结果：同一 token 会被连续检查多次，又不必在内存里攒一批 token
+        memo = TokenManager._jwt_exp_memo
+        if memo[0] == access_token:
+            return memo[1]
+        try:
+            payload = access_token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            exp = int(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+        except Exception:
+            exp = None
+        # 整体替换元组，其他线程读到的 token 与 exp 总是成对的
+        TokenManager._jwt_exp_memo = (access_token, exp)
+        return exp
+
+    @staticmethod
+    def invalidate_usage_cache(token_id):
+        with TokenManager._usage_cache_lock:
+            TokenManager._usage_cache.pop(str(token_id), None)
+
+    @staticmethod
+    def query_usage(access_token: str, refresh_tok: str = None, timeout: float = 30,
+                    token_id=None, max_age: float = USAGE_CACHE_TTL) -> tuple[float, dict, dict | None]:
+        """查询额度，失败时尝试刷新 token 重试。返回 (ratio, info, new_tokens)
+
+        传入 token_id 时，max_age 秒内的成功结果直接复用缓存；max_age=0 表示强制联网但仍更新缓存。
+        """
+        if token_id is not None and max_age > 0:
+            with TokenManager._usage_cache_lock:
+                cached = TokenManager._usage_cache.get(str(token_id))
+            if cached and time.monotonic() - cached[0] < max_age:
+                return cached[1], cached[2], None
+
+        ratio, info, new_tokens = TokenManager._query_usage_uncached(access_token, refresh_tok, timeout)
+        if token_id is not None:
+            with TokenManager._usage_cache_lock:
+                if ratio >= 0:
+                    TokenManager._usage_cache[str(token_id)] = (time.monotonic(), ratio, info)
+                else:
+                    # 最新一次查询失败时，之前的成功结果不能再当作有效数据复用
+                    TokenManager._usage_cache.pop(str(token_id), None)
+        return ratio, info, new_tokens
 
     @staticmethod
-    def query_usage(access_token: str, refresh_tok: str = None, timeout: float = 30) -> tuple[float, dict, dict | None]:
-        """查询额度，失败时尝试刷新 token 重试。返回 (ratio, info, new_tokens)"""
-        if access_token:
-            ratio, info = TokenManager._do_query(access_token, timeout=timeout)
+    def _query_usage_uncached(access_token: str, refresh_tok: str | None, timeout: float):
+        # 已知即将过期的 access_token 不必先查一次注定失败的额度，直接刷新
+        exp = TokenManager.jwt_exp(access_token) if access_token else None
+        if access_token and (exp is None or exp - time.time() >= TOKEN_EXPIRY_MARGIN):
+            ratio, info, status = TokenManager._do_query(access_token, timeout=timeout)
             if ratio >= 0:
                 return ratio, info, None
+            # 只有鉴权失败才值得刷新；网络错误、限流或服务端错误换 token 也无济于事
+            if status not in REFRESH_ON_STATUS:
+                return -1, {}, None
         
         if refresh_tok:
             result = TokenManager.refresh_token(refresh_tok, timeout=timeout)
@@ -166,15 +540,16 @@ class TokenManager:
                 new_at = (result.get("access_token") or "").strip()
                 new_rt = (result.get("refresh_token") or refresh_tok or "").strip()
                 if new_at:
-                    ratio, info = TokenManager._do_query(new_at, timeout=timeout)
-                    if ratio >= 0:
-                        return ratio, info, {"access_token": new_at, "refresh_token": new_rt}
+                    new_tokens = {"access_token": new_at, "refresh_token": new_rt}
+                    ratio, info, _ = TokenManager._do_query(new_at, timeout=timeout)
+                    # 刷新后旧 refresh_token 已失效，即使查询失败也要把新 token 交给调用方保存
+                    return (ratio, info, new_tokens) if ratio >= 0 else (-1, {}, new_tokens)
         
         return -1, {}, None
 
-    def init_active_token(self):
-        """确保 auth.json 中的账号有 id"""
-        active = TokenManager.load_active_token()
+    def init_active_token(self, active: dict | None = None):
+        """确保 auth.json 中的账号有 id；传入的 active 会被就地补上 id"""
+        active = active or TokenManager.load_active_token()
         if active and not active.get("id"):
             # 优先尝试按 refresh_token 在备用池中匹配，避免生成新 id 导致对不上号
             rt = active.get("refresh_token", "")
@@ -189,27 +564,25 @@ class TokenManager:
             return f"已为当前激活账号生成 ID: {active['id']}"
         return None
 
-    def sync_on_start(self):
+    def sync_on_start(self, active: dict | None = None):
         """启动时同步：用 id 判断，如果 auth.json 中的账号在备用池中，更新备用池中的 token"""
-        active = TokenManager.load_active_token()
+        active = active or TokenManager.load_active_token()
         if not active or not active.get("id"):
             return None
         
         active_id = active["id"]
         tokens = TokenManager.load_backup_tokens()
-        updated = False
-        
-        for t in tokens:
-            if t.get("id") == active_id:
-                t["refresh_token"] = active.get("refresh_token", "")
-                t["access_token"] = active.get("access_token", "")
-                updated = True
-                message = f"已同步账号 {active_id} 的最新 token 到备用池"
-                break
+        idx = TokenManager.index_by_id(tokens).get(active_id)
         
-        if updated:
+        if idx is not None:
+            t = tokens[idx]
+            before = dict(t)
+            t["refresh_token"] = active.get("refresh_token", "")
+            t["access_token"] = active.get("access_token", "")
+            if t == before:
+                return None
             TokenManager.save_backup_tokens(tokens)
-            return message
+            return f"已同步账号 {active_id} 的最新 token 到备用池"
         
         return None
 
@@ -226,22 +599,24 @@ class TokenManager:
                 return
             if ratio >= 0:
                 t["ratio"] = ratio
+                t["available"] = TokenManager.is_available(ratio)
                 if ratio >= WARN_THRESHOLD:
                     t["status"] = "额度不足"
                 else:
                     t["status"] = "active"
 
-        found = False
-        for t in tokens:
-            if t.get("id") == active["id"]:
-                t["refresh_token"] = active.get("refresh_token", "")
-                t["access_token"] = active.get("access_token", "")
-                t.setdefault("status", "active")
-                apply_usage_fields(t)
-                found = True
-                break
-
-        if not found:
+        idx = TokenManager.index_by_id(tokens).get(active["id"])
+        if idx is not None:
+            t = tokens[idx]
+            before = dict(t)
+            t["refresh_token"] = active.get("refresh_token", "")
+            t["access_token"] = active.get("access_token", "")
+            t.setdefault("status", "active")
+            apply_usage_fields(t)
+            # 额度与 token 都没变时（空闲账号的常见情况）不必重写整个备用池
+            if t == before:
+                return
+        else:
             new_entry = {
                 "id": active["id"],
                 "refresh_token": active.get("refresh_token", ""),
@@ -263,25 +638,38 @@ class TokenManager:
             active = TokenManager.load_active_token()
             active_id = active.get("id") if active else None
             
-            # 筛选可用账号（排除当前账号）
-            available_tokens = []
-            for t in tokens:
-                if t.get("id") != active_id:
-                    ratio = t.get("ratio", 0)
-                    if ratio < WARN_THRESHOLD:  # 额度充足
-                        available_tokens.append(t)
+            # 一次遍历筛选可用账号（排除当前账号、额度充足），只取优先级最高的前几个，
+            # 不生成中间列表也不做整表排序
+            candidates = heapq.nsmallest(
+                AUTO_SWITCH_CANDIDATES,
+                (t for t in tokens if t.get("id") != active_id and TokenManager._is_candidate(t)),
+                key=TokenManager._switch_priority,
+            )
             
-            if not available_tokens:
+            if not candidates:
                 if callback:
                     callback("error", "没有可用的备用账号")
                 return False
             
-            # 选择额度最充足的账号
-            best_token = min(available_tokens, key=lambda t: t.get("ratio", 1))
-            token_id = best_token.get("id")
+            # 并发验证这几个候选账号，避免逐个串行等待超时
+            results = TokenManager._query_candidates(candidates)
+            TokenManager._persist_candidate_results(candidates, results)
+
+            verified = [
+                (ratio, t.get("id"))
+                for t, (ratio, info, new_tokens) in zip(candidates, results)
+                if 0 <= ratio < WARN_THRESHOLD
+            ]
+            if not verified:
+                if callback:
+                    callback("error", "自动切换失败")
+                return False
+
+            # 选择实测额度最充足的账号
+            token_id = min(verified, key=lambda v: v[0])[1]
             
             # 执行自动切换
-            if self._perform_auto_switch(token_id):
+            if self._perform_auto_switch(token_id, verified=True):
                 if callback:
                     callback("success", token_id)
                 return True
@@ -295,8 +683,68 @@ class TokenManager:
                 callback("error", f"自动切换过程出错: {e}")
             return False
 
-    def _perform_auto_switch(self, token_id):
-        """执行自动切换到指定账号"""
+    @staticmethod
+    def is_available(ratio: float) -> bool:
+        """额度查询结果是否可作为自动切换目标；写入 ratio 时同步写入 t["available"]"""
+        return 0 <= ratio < WARN_THRESHOLD
+
+    @staticmethod
+    def _is_candidate(t: dict) -> bool:
+        available = t.get("available")
+        if available is None:
+            # 旧版本写入、尚未带 available 标记的条目按 ratio 判断
+            return t.get("ratio", 0) < WARN_THRESHOLD
+        return available
+
+    @staticmethod
+    def _switch_priority(t: dict):
+        """已知额度的账号按已用比例升序；未查询/查询失败的排在最后"""
+        ratio = t.get("ratio")
+        if ratio is None or ratio < 0:
+            return (1, 0)
+        return (0, ratio)
+
+    @staticmethod
+    def _query_candidates(candidates: list) -> list:
+        """并发查询候选账号额度，结果顺序与 candidates 一致"""
+        def query(t: dict):
+            return TokenManager.query_usage(
+                t.get("access_token", ""), t.get("refresh_token", ""),
+                timeout=AUTO_SWITCH_TIMEOUT, token_id=t.get("id"),
+            )
+
+        with ThreadPoolExecutor(max_workers=len(candidates)) as ex:
+            return list(ex.map(query, candidates))
+
+    @staticmethod
+    def _persist_candidate_results(candidates: list, results: list):
+        """把候选账号的查询结果写回备用池：刷新过的 token 必须保存（旧 refresh_token 已失效），
+        实测额度/状态也一并更新，否则额度不足或失效的账号下次仍会被选为候选"""
+        by_id = {t.get("id", ""): result for t, result in zip(candidates, results)}
+        tokens = TokenManager.load_backup_tokens()
+        updated = False
+        for t in tokens:
+            result = by_id.get(t.get("id", ""))
+            if result is None:
+                continue
+            ratio, info, new_tokens = result
+            before = dict(t)
+            if new_tokens:
+                t["access_token"] = new_tokens.get("access_token", "")
+                t["refresh_token"] = new_tokens.get("refresh_token", "")
+            t["available"] = TokenManager.is_available(ratio)
+            if ratio >= 0:
+                t["ratio"] = ratio
+                t["status"] = "额度不足" if ratio >= WARN_THRESHOLD else "active"
+            else:
+                t["ratio"] = -1
+                t["status"] = "失效"
+            updated = updated or t != before
+        if updated:
+            TokenManager.save_backup_tokens(tokens)
+
+    def _perform_auto_switch(self, token_id, verified: bool = False):
+        """执行自动切换到指定账号；verified 为 True 表示调用方刚验证过额度"""
         if self._switch_inflight:
             return False
         
@@ -304,25 +752,26 @@ class TokenManager:
         
         try:
             tokens = TokenManager.load_backup_tokens()
-            backup_token = None
-            backup_idx = -1
+            index = TokenManager.index_by_id(tokens)
+            backup_idx = index.get(token_id)
             
-            for i, t in enumerate(tokens):
-                if t.get("id") == token_id:
-                    backup_token = t
-                    backup_idx = i
-                    break
-            
-            if not backup_token:
+            if backup_idx is None:
                 return False
+            backup_token = tokens[backup_idx]
             
-            # 验证账号可用性
-            at = backup_token.get("access_token", "")
-            rt = backup_token.get("refresh_token", "")
-            ratio, info, new_tokens = TokenManager.query_usage(at, rt)
-            
-            if ratio < 0 or ratio >= 1.0:
-                return False
+            if not verified:
+                # 验证账号可用性
+                at = backup_token.get("access_token", "")
+                rt = backup_token.get("refresh_token", "")
+                ratio, info, new_tokens = TokenManager.query_usage(at, rt, token_id=token_id)
+                if new_tokens:
+                    backup_token["access_token"] = new_tokens.get("access_token", "")
+                    backup_token["refresh_token"] = new_tokens.get("refresh_token", "")
+                
+                if ratio < 0 or ratio >= 1.0:
+                    if new_tokens:
+                        TokenManager.save_backup_tokens(tokens)
+                    return False
             
             # 执行切换
             old_active = TokenManager.load_active_token()
@@ -331,22 +780,30 @@ class TokenManager:
                 tokens.pop(backup_idx)
                 
                 if old_active and old_active.get("id"):
-                    found = False
-                    for t in tokens:
-                        if t.get("id") == old_active["id"]:
-                            t["refresh_token"] = old_active.get("refresh_token", "")
-                            t["access_token"] = old_active.get("access_token", "")
-                            found = True
-                            break
-                    if not found:
+                    # pop 之后下标已变化，需重新建索引
+                    old_idx = TokenManager.index_by_id(tokens).get(old_active["id"])
+                    if old_idx is not None:
+                        t = tokens[old_idx]
+                        t["refresh_token"] = old_active.get("refresh_token", "")
+                        t["access_token"] = old_active.get("access_token", "")
+                    else:
                         old_active["status"] = "active"
                         tokens.insert(0, old_active)
                 
                 TokenManager.save_backup_tokens(tokens)
+                if old_active and old_active.get("id"):
+                    # 旧账号一直在用，切换前缓存的额度已过时
+                    TokenManager.invalidate_usage_cache(old_active["id"])
                 return True
             
             return False
         except Exception as e:
             return False
         finally:
-            self._switch_inflight = False
\ No newline at end of file
+            # 切换后该账号即成为当前账号，额度会持续变化，缓存不再可信
+            TokenManager.invalidate_usage_cache(token_id)
+            self._switch_inflight = False
+
+
+# 退出时确保防抖中的备用池修改写入磁盘
+atexit.register(TokenManager.flush_pending_tokens)